@@ -11,24 +11,104 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import base64
+import hashlib
+import http.client
+import io
 import json
+import mmap
 import os
+import pickle
 import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON encode/decode when installed
+    orjson = None
+
+ReadableBuffer = Union[bytes, mmap.mmap]
+Span = Tuple[int, int]
+NO_SPAN: Span = (0, 0)
+T = TypeVar("T")
+R = TypeVar("R")
+
+SYNTHETIC_TEMPERATURE = 0.3
+INDEX_CACHE_VERSION = 5
+PROMPT_INPUT_KEYS = (
+    ("B", "biomarker_analysis"),
+    ("P", "preference_analysis"),
+    ("C", "patient_context"),
+    ("PRO", "selected_protocols"),
+)
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+_H3_RE = re.compile(r"^###\s+.+\s*$", re.M)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Line boundaries str.splitlines() knows besides "\n".
+_LINE_BREAKS = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_PROTO_SPLIT_RE = re.compile(r"^(?=[^\S\n]*## [^\S\n]*\S)", re.M)
+# A fence info string running into a non-ASCII byte, which the bytes fence
+# scan cannot judge (\w on the decoded text may accept it).
+_NON_ASCII_INFO_RE = re.compile(rb"```\w*[\x80-\xff]")
+
+
+class ProtocolChunk(NamedTuple):
+    """One ``##`` protocol; the subsections are (start, end) spans into body."""
 
-@dataclass
-class ProtocolChunk:
     title: str
     protocol_name: str
     body: str
-    primary_recommendation: str
-    secondary_recommendations: str
-    safety_considerations: str
-    evidence_sources: str
+    primary_span: Span = NO_SPAN
+    secondary_span: Span = NO_SPAN
+    safety_span: Span = NO_SPAN
+    evidence_span: Span = NO_SPAN
+    title_tokens: FrozenSet[str] = frozenset()
+    name_tokens: FrozenSet[str] = frozenset()
+
+    @property
+    def primary_recommendation(self) -> str:
+        return self.body[slice(*self.primary_span)]
+
+    @property
+    def secondary_recommendations(self) -> str:
+        return self.body[slice(*self.secondary_span)]
+
+    @property
+    def safety_considerations(self) -> str:
+        return self.body[slice(*self.safety_span)]
+
+    @property
+    def evidence_sources(self) -> str:
+        return self.body[slice(*self.evidence_span)]
 
 
 def read_text(path: Path) -> str:
@@ -50,145 +130,433 @@ def load_dotenv(dotenv_path: Path) -> None:
 
 
 def normalize(text: str) -> List[str]:
-    cleaned = re.sub(r"[^a-z0-9 ]+", " ", text.lower())
-    return [t for t in cleaned.split() if t]
+    return _TOKEN_RE.findall(text.lower())
+
+
+@lru_cache(maxsize=4096)
+def _normalize_cached(text: str) -> FrozenSet[str]:
+    return frozenset(normalize(text))
+
 
+def iter_fenced_blocks(text: Any, lang: Any = None) -> Iterator[Any]:
+    """Yield the bodies of ```-fenced blocks using str.find instead of a regex.
 
-def jaccard(a: Iterable[str], b: Iterable[str]) -> float:
-    sa = set(a)
-    sb = set(b)
-    if not sa or not sb:
-        return 0.0
-    return len(sa & sb) / len(sa | sb)
+    text may be a str, bytes or mmap. With lang=None any word-character info
+    string is accepted; otherwise only lang or no info string. A fence whose
+    opening line has anything else on it is retried one character later,
+    exactly as the old regexes backtracked.
+    """
+    if isinstance(text, str):
+        fence, newline, underscore = "```", "\n", "_"
+    else:
+        fence, newline, underscore = b"```", b"\n", b"_"
+    size = len(text)
+    pos = 0
+    while True:
+        start = text.find(fence, pos)
+        if start < 0:
+            return
+        i = start + 3
+        if lang is None:
+            while i < size and (
+                text[i:i + 1].isalnum() or text[i:i + 1] == underscore
+            ):
+                i += 1
+        elif text[i:i + len(lang) + 1] == lang + newline:
+            i += len(lang)
+        if text[i:i + 1] != newline:
+            pos = start + 1
+            continue
+        end = text.find(fence, i + 1)
+        if end < 0:
+            return
+        yield text[i + 1:end]
+        pos = end + 3
 
 
 def extract_code_blocks(text: str) -> List[str]:
-    return re.findall(r"```(?:\w+)?\n(.*?)```", text, flags=re.S)
+    return list(iter_fenced_blocks(text))
 
 
 def split_protocol_blocks(block: str) -> List[str]:
-    lines = block.splitlines()
-    chunks: List[List[str]] = []
-    current: List[str] = []
-    for line in lines:
-        if line.strip().startswith("## "):
-            if current:
-                chunks.append(current)
-            current = [line]
-        else:
-            if current:
-                current.append(line)
-    if current:
-        chunks.append(current)
-    return ["\n".join(c).strip() for c in chunks]
+    # Cut on the same boundaries as the original splitlines() scan: other
+    # line separators are folded to "\n" before the "\n"-only regex runs.
+    if any(sep in block for sep in _LINE_BREAKS):
+        block = "\n".join(block.splitlines())
+    # The first part is whatever precedes the first ``## `` line.
+    return [p.strip() for p in _PROTO_SPLIT_RE.split(block)[1:]]
 
 
-def extract_section(text: str, heading: str) -> str:
-    pattern = re.compile(
-        rf"^###\s+{re.escape(heading)}\s*$",
-        flags=re.M,
-    )
-    match = pattern.search(text)
-    if not match:
-        return ""
+@lru_cache(maxsize=64)
+def _heading_re(heading: str) -> re.Pattern[str]:
+    return re.compile(rf"^###\s+{re.escape(heading)}\s*$", re.M)
+
+
+def _h3_line_starts(text: str) -> List[int]:
+    starts = [0] if text.startswith("###") else []
+    pos = text.find("\n###")
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = text.find("\n###", pos + 1)
+    return starts
+
+
+def extract_section_span(
+    text: str,
+    heading: str,
+    h3_starts: Optional[List[int]] = None,
+) -> Span:
+    """Return the stripped span of the ``### heading`` section of text.
+
+    The section runs to the next ``###`` line. As in the original regex, the
+    whitespace after ``###`` may cross a newline, so a bare ``###`` followed
+    by more text also ends it. Both patterns are only tried where a line starts with
+    ``###``; pass h3_starts to share that scan between headings.
+    """
+    if h3_starts is None:
+        h3_starts = _h3_line_starts(text)
+    pattern = _heading_re(heading)
+    for pos in h3_starts:
+        match = pattern.match(text, pos)
+        if match:
+            break
+    else:
+        return NO_SPAN
     start = match.end()
-    next_heading = re.search(r"^###\s+.+\s*$", text[start:], flags=re.M)
-    end = start + next_heading.start() if next_heading else len(text)
-    return text[start:end].strip()
+    end = next(
+        (pos for pos in h3_starts if pos >= start and _H3_RE.match(text, pos)),
+        len(text),
+    )
+    section = text[start:end]
+    start += len(section) - len(section.lstrip())
+    return start, max(start, end - (len(section) - len(section.rstrip())))
+
+
+def parse_protocol_block(block: str) -> List[ProtocolChunk]:
+    chunks: List[ProtocolChunk] = []
+    for chunk_text in split_protocol_blocks(block):
+        lines = chunk_text.splitlines()
+        title_line = lines[0].strip()
+        title = title_line.replace("##", "", 1).strip()
+        protocol_name = ""
+        for line in lines:
+            if line.strip().startswith("**Protocol:**"):
+                protocol_name = line.replace("**Protocol:**", "").strip()
+                break
+        # split_protocol_blocks already strips, so spans index the body as-is.
+        h3_starts = _h3_line_starts(chunk_text)
+        primary, secondary, safety, evidence = (
+            extract_section_span(chunk_text, heading, h3_starts)
+            for heading in (
+                "Primary Recommendation",
+                "Secondary Recommendations",
+                "Safety Considerations",
+                "Evidence Sources",
+            )
+        )
+        chunks.append(
+            ProtocolChunk(
+                title=title,
+                protocol_name=protocol_name,
+                body=chunk_text,
+                primary_span=primary,
+                secondary_span=secondary,
+                safety_span=safety,
+                evidence_span=evidence,
+                title_tokens=frozenset(normalize(title)),
+                name_tokens=frozenset(normalize(protocol_name)),
+            )
+        )
+    return chunks
 
 
 def parse_protocol_chunks(protocols_text: str) -> List[ProtocolChunk]:
     chunks: List[ProtocolChunk] = []
     for block in extract_code_blocks(protocols_text):
-        for chunk_text in split_protocol_blocks(block):
-            lines = chunk_text.splitlines()
-            title_line = lines[0].strip()
-            title = title_line.replace("##", "", 1).strip()
-            protocol_name = ""
-            for line in lines:
-                if line.strip().startswith("**Protocol:**"):
-                    protocol_name = line.replace("**Protocol:**", "").strip()
-                    break
-            primary = extract_section(chunk_text, "Primary Recommendation")
-            secondary = extract_section(chunk_text, "Secondary Recommendations")
-            safety = extract_section(chunk_text, "Safety Considerations")
-            evidence = extract_section(chunk_text, "Evidence Sources")
-            chunks.append(
-                ProtocolChunk(
-                    title=title,
-                    protocol_name=protocol_name,
-                    body=chunk_text.strip(),
-                    primary_recommendation=primary,
-                    secondary_recommendations=secondary,
-                    safety_considerations=safety,
-                    evidence_sources=evidence,
-                )
-            )
+        chunks.extend(parse_protocol_block(block))
+    return chunks
+
+
+def parse_protocol_buffer(buf: ReadableBuffer) -> List[ProtocolChunk]:
+    """Like parse_protocol_chunks, but decodes only the fenced blocks of buf.
+
+    A file with any carriage return, or with a non-ASCII fence info string, is
+    decoded whole and given the same universal-newline translation read_text
+    applies, so it parses exactly as parse_protocol_chunks(read_text(path)).
+    """
+    if buf.find(b"\r") >= 0 or _NON_ASCII_INFO_RE.search(buf):
+        text = bytes(buf).decode("utf-8")
+        return parse_protocol_chunks(text.replace("\r\n", "\n").replace("\r", "\n"))
+    chunks: List[ProtocolChunk] = []
+    for block in iter_fenced_blocks(buf):
+        chunks.extend(parse_protocol_block(block.decode("utf-8")))
     return chunks
 
 
+@contextmanager
+def map_file(path: Path) -> Iterator[ReadableBuffer]:
+    """Memory-map path read-only; empty files (which mmap rejects) yield b""."""
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def parse_protocol_file(path: Path) -> List[ProtocolChunk]:
+    with map_file(path) as buf:
+        return parse_protocol_buffer(buf)
+
+
+@dataclass(slots=True)
+class ProtocolIndex:
+    """Per-chunk fields as parallel lists, addressed by chunk position."""
+
+    titles: List[str]
+    names: List[str]
+    bodies: List[str]
+    primary_spans: List[Span]
+    secondary_spans: List[Span]
+    safety_spans: List[Span]
+    evidence_spans: List[Span]
+    vocab: Dict[str, int]
+    postings: Dict[str, List[int]]
+    title_masks: List[int]
+    name_masks: List[int]
+    exact_by_name: Dict[str, int]
+    exact_by_title: Dict[str, int]
+
+
+def token_mask(tokens: FrozenSet[str], vocab: Dict[str, int]) -> int:
+    mask = 0
+    for token in tokens:
+        if token in vocab:
+            mask |= 1 << vocab[token]
+    return mask
+
+
+def exact_lookup(values: Iterable[str]) -> Dict[str, int]:
+    """Map each lowercased value to the first chunk position carrying it."""
+    lookup: Dict[str, int] = {}
+    for i, value in enumerate(values):
+        if value:
+            lookup.setdefault(value.lower(), i)
+    return lookup
+
+
+def build_protocol_index(protocol_chunks: List[ProtocolChunk]) -> ProtocolIndex:
+    vocab: Dict[str, int] = {}
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for i, chunk in enumerate(protocol_chunks):
+        for token in chunk.title_tokens | chunk.name_tokens:
+            vocab.setdefault(token, len(vocab))
+            postings[token].append(i)
+    return ProtocolIndex(
+        titles=[c.title for c in protocol_chunks],
+        names=[c.protocol_name for c in protocol_chunks],
+        bodies=[c.body for c in protocol_chunks],
+        primary_spans=[c.primary_span for c in protocol_chunks],
+        secondary_spans=[c.secondary_span for c in protocol_chunks],
+        safety_spans=[c.safety_span for c in protocol_chunks],
+        evidence_spans=[c.evidence_span for c in protocol_chunks],
+        vocab=vocab,
+        postings=dict(postings),
+        title_masks=[token_mask(c.title_tokens, vocab) for c in protocol_chunks],
+        name_masks=[token_mask(c.name_tokens, vocab) for c in protocol_chunks],
+        exact_by_name=exact_lookup(c.protocol_name for c in protocol_chunks),
+        exact_by_title=exact_lookup(c.title for c in protocol_chunks),
+    )
+
+
+def load_or_parse(path: Path, cache_dir: Path = Path(".cache")) -> ProtocolIndex:
+    """Return the ProtocolIndex for path, reusing a pickle from a previous run.
+
+    The pickle is keyed by the file's size, mtime and a SHA-1 prefix, so any
+    edit to protocols.txt (or a bump of INDEX_CACHE_VERSION) forces a reparse.
+    """
+    stat = path.stat()
+    cache = cache_dir / f"{path.stem}.pkl"
+    with map_file(path) as buf:
+        key = (
+            INDEX_CACHE_VERSION,
+            stat.st_size,
+            stat.st_mtime_ns,
+            hashlib.sha1(buf).hexdigest()[:16],
+        )
+        if cache.exists():
+            try:
+                with cache.open("rb") as f:
+                    cached_key, index = pickle.load(f)
+            except (
+                OSError,
+                EOFError,
+                AttributeError,
+                ImportError,
+                TypeError,
+                ValueError,
+                pickle.UnpicklingError,
+            ):
+                cached_key, index = None, None
+            if cached_key == key:
+                return index
+        index = build_protocol_index(parse_protocol_buffer(buf))
+
+    # The cache is only an optimisation: a read-only checkout, a full disk or
+    # a file named .cache must not stop the run.
+    tmp = cache.with_suffix(".tmp")
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with tmp.open("wb") as f:
+            pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(cache)
+    except OSError:
+        pass
+    return index
+
+
 def best_match_protocol(
     query: str,
-    protocol_chunks: List[ProtocolChunk],
-) -> Optional[ProtocolChunk]:
-    query_tokens = normalize(query)
-    best: Tuple[float, Optional[ProtocolChunk]] = (0.0, None)
-    for chunk in protocol_chunks:
+    index: ProtocolIndex,
+) -> Optional[int]:
+    query_tokens = _normalize_cached(query)
+    if not query_tokens:
+        return None
+    query_mask = token_mask(query_tokens, index.vocab)
+    # Tokens outside the protocol vocabulary never intersect but still count
+    # towards the union.
+    unseen = len(query_tokens) - query_mask.bit_count()
+
+    # Only chunks sharing a token with the query can score above zero; visit
+    # them in chunk order so ties resolve to the earliest chunk.
+    candidates: Set[int] = set()
+    for token in query_tokens:
+        candidates.update(index.postings.get(token, ()))
+    title_masks = index.title_masks
+    name_masks = index.name_masks
+    best: Tuple[float, Optional[int]] = (0.0, None)
+    # Jaccard over the token bitmasks, with the unseen tokens added to each
+    # union; every candidate shares a query token, so no union is empty.
+    for i in sorted(candidates):
+        title_mask = title_masks[i]
+        name_mask = name_masks[i]
         score = max(
-            jaccard(query_tokens, normalize(chunk.title)),
-            jaccard(query_tokens, normalize(chunk.protocol_name)),
+            (query_mask & title_mask).bit_count()
+            / ((query_mask | title_mask).bit_count() + unseen),
+            (query_mask & name_mask).bit_count()
+            / ((query_mask | name_mask).bit_count() + unseen),
         )
         if score > best[0]:
-            best = (score, chunk)
+            best = (score, i)
     return best[1]
 
 
+def match_protocol(
+    theme: str,
+    protocol_name: str,
+    index: ProtocolIndex,
+) -> Optional[int]:
+    """Resolve a PRO entry by exact protocol name or title, else by Jaccard."""
+    if protocol_name:
+        i = index.exact_by_name.get(protocol_name.lower())
+        if i is not None:
+            return i
+    if theme:
+        i = index.exact_by_title.get(theme.lower())
+        if i is not None:
+            return i
+    return best_match_protocol(" ".join([theme, protocol_name]).strip(), index)
+
+
+def best_match_protocols(
+    entries: List[Tuple[str, str]],
+    index: ProtocolIndex,
+) -> List[Optional[int]]:
+    matches: Dict[Tuple[str, str], Optional[int]] = {}
+    for entry in entries:
+        if entry not in matches:
+            matches[entry] = match_protocol(*entry, index)
+    return [matches[entry] for entry in entries]
+
+
 def build_rag_protocols(
     selected_protocols: List[Dict[str, Any]],
-    protocol_chunks: List[ProtocolChunk],
+    index: ProtocolIndex,
 ) -> List[Dict[str, Any]]:
     rag_protocols: List[Dict[str, Any]] = []
-    for item in selected_protocols:
-        theme = str(item.get("theme", "")).strip()
-        protocol_name = str(item.get("protocol_name", "")).strip()
-        query = " ".join([theme, protocol_name]).strip()
-        matched = best_match_protocol(query, protocol_chunks)
+    themes = [str(item.get("theme", "")).strip() for item in selected_protocols]
+    names = [str(item.get("protocol_name", "")).strip() for item in selected_protocols]
+    matches = best_match_protocols(list(zip(themes, names)), index)
+
+    def pick(values: List[str], i: Optional[int]) -> str:
+        return values[i] if i is not None else ""
+
+    def section(spans: List[Span], i: Optional[int]) -> str:
+        if i is None:
+            return ""
+        start, end = spans[i]
+        return index.bodies[i][start:end]
+
+    for item, theme, protocol_name, matched in zip(
+        selected_protocols, themes, names, matches
+    ):
         rag_protocols.append(
             {
                 "rank": item.get("rank"),
                 "theme": theme,
                 "protocol_name": protocol_name,
                 "evidence_source": item.get("evidence_source"),
-                "matched_protocol_title": matched.title if matched else "",
+                "matched_protocol_title": pick(index.titles, matched),
                 "protocol_details": {
-                    "primary_recommendation": matched.primary_recommendation
-                    if matched
-                    else "",
-                    "secondary_recommendations": matched.secondary_recommendations
-                    if matched
-                    else "",
-                    "safety_considerations": matched.safety_considerations
-                    if matched
-                    else "",
-                    "evidence_sources": matched.evidence_sources if matched else "",
-                    "full_protocol_text": matched.body if matched else "",
+                    "primary_recommendation": section(index.primary_spans, matched),
+                    "secondary_recommendations": section(
+                        index.secondary_spans, matched
+                    ),
+                    "safety_considerations": section(index.safety_spans, matched),
+                    "evidence_sources": section(index.evidence_spans, matched),
+                    "full_protocol_text": pick(index.bodies, matched),
                 },
             }
         )
     return rag_protocols
 
 
+def make_prompt_input_builder(
+    sample: Dict[str, Any],
+) -> Callable[[Dict[str, Any], List[Dict[str, Any]]], Dict[str, Any]]:
+    """Specialize build_prompt_input to the key names used by sample.
+
+    Each short key (B, P, C, PRO) or its long alias is chosen once, so
+    callers converting many inputs of one schema do a single lookup per field
+    instead of the ``get(short) or get(long)`` fallback. For sample itself the
+    result is identical to build_prompt_input.
+    """
+    keys = tuple(
+        (short, short if sample.get(short) else long)
+        for short, long in PROMPT_INPUT_KEYS
+    )
+
+    def build(
+        input_data: Dict[str, Any],
+        rag_protocols: List[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        prompt_input = {short: input_data.get(key) for short, key in keys}
+        prompt_input["PD"] = rag_protocols
+        return prompt_input
+
+    return build
+
+
 def build_prompt_input(
     input_data: Dict[str, Any],
     rag_protocols: List[Dict[str, Any]],
 ) -> Dict[str, Any]:
-    return {
-        "B": input_data.get("B") or input_data.get("biomarker_analysis"),
-        "P": input_data.get("P") or input_data.get("preference_analysis"),
-        "C": input_data.get("C") or input_data.get("patient_context"),
-        "PRO": input_data.get("PRO") or input_data.get("selected_protocols"),
-        "PD": rag_protocols,
+    prompt_input = {
+        short: input_data.get(short) or input_data.get(long)
+        for short, long in PROMPT_INPUT_KEYS
     }
+    prompt_input["PD"] = rag_protocols
+    return prompt_input
 
 
 def build_combined_prompt(prompt_text: str, prompt_input: Dict[str, Any]) -> str:
@@ -196,13 +564,162 @@ def build_combined_prompt(prompt_text: str, prompt_input: Dict[str, Any]) -> str
     return f"{prompt_text.rstrip()}\n\n<input>\n{payload}\n</input>\n"
 
 
+def write_combined_prompt(
+    f: TextIO,
+    prompt_text: str,
+    prompt_input: Dict[str, Any],
+) -> None:
+    """Write build_combined_prompt output to f without building the string."""
+    f.write(prompt_text.rstrip())
+    f.write("\n\n<input>\n")
+    json.dump(prompt_input, f, indent=2, ensure_ascii=True)
+    f.write("\n</input>\n")
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON, accepting exactly what json.loads on UTF-8 text accepts.
+
+    orjson is only a fast path: anything it rejects (NaN, integers beyond 64
+    bits) is handed to the stdlib, which also decides on errors such as a BOM.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """Compact UTF-8 JSON for request bodies."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _write_json(path: Path, obj: Any) -> None:
+    with Path(path).open("w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, ensure_ascii=True)
+
+
 def strip_code_fences(text: str) -> str:
-    fenced = re.findall(r"```(?:json)?\n(.*?)```", text, flags=re.S)
-    if fenced:
-        return fenced[0].strip()
+    fenced = next(iter_fenced_blocks(text, "json"), None)
+    if fenced is not None:
+        return fenced.strip()
     return text.strip()
 
 
+_connections = threading.local()
+
+
+class _PooledConnection(NamedTuple):
+    conn: http.client.HTTPConnection
+    absolute_target: bool
+    headers: Dict[str, str]
+
+
+def _open_connection(scheme: str, netloc: str) -> _PooledConnection:
+    """Connect to netloc, or through the http/https proxy urllib would use.
+
+    https is tunnelled with CONNECT; plain http is sent to the proxy with an
+    absolute target and its Proxy-Authorization on every request.
+    """
+    conn_class = (
+        http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    )
+    host = urllib.parse.urlsplit(f"//{netloc}").hostname or netloc
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return _PooledConnection(conn_class(netloc), False, {})
+    proxy_parts = urllib.parse.urlsplit(proxy if "://" in proxy else f"//{proxy}")
+    proxy_headers: Dict[str, str] = {}
+    if proxy_parts.username:
+        credentials = ":".join(
+            urllib.parse.unquote(p or "")
+            for p in (proxy_parts.username, proxy_parts.password)
+        )
+        token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        proxy_headers["Proxy-Authorization"] = f"Basic {token}"
+    conn = conn_class(proxy_parts.netloc.rpartition("@")[2])
+    if scheme == "https":
+        conn.set_tunnel(netloc, headers=proxy_headers)
+        return _PooledConnection(conn, False, {})
+    return _PooledConnection(conn, True, proxy_headers)
+
+
+def _get_connection(scheme: str, netloc: str) -> _PooledConnection:
+    """Return the calling thread's keep-alive connection to netloc."""
+    pool = getattr(_connections, "pool", None)
+    if pool is None:
+        pool = _connections.pool = {}
+    pooled = pool.get((scheme, netloc))
+    if pooled is None:
+        pooled = pool[(scheme, netloc)] = _open_connection(scheme, netloc)
+    return pooled
+
+
+def _drop_connection(scheme: str, netloc: str) -> None:
+    pooled = getattr(_connections, "pool", {}).pop((scheme, netloc), None)
+    if pooled is not None:
+        pooled.conn.close()
+
+
+def openai_request(
+    api_base: str,
+    api_key: str,
+    path: str,
+    body: Optional[bytes] = None,
+    content_type: str = "application/json",
+    timeout: float = 60,
+) -> bytes:
+    url = api_base.rstrip("/") + path
+    parts = urllib.parse.urlsplit(url)
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if body is not None:
+        headers["Content-Type"] = content_type
+    method = "POST" if body is not None else "GET"
+
+    # Reuse the thread's connection so repeated calls skip the TCP/TLS
+    # handshake. Any failure discards it, so a timed-out request can never
+    # leave its late response to be read by the next call; only a reused
+    # socket the server has since closed is retried, once, on a fresh one.
+    for attempt in range(2):
+        pooled = _get_connection(parts.scheme, parts.netloc)
+        conn = pooled.conn
+        reused = conn.sock is not None
+        conn.timeout = timeout
+        if reused:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request(
+                method,
+                url if pooled.absolute_target else target,
+                body=body,
+                headers={**pooled.headers, **headers},
+            )
+            resp = conn.getresponse()
+            data = resp.read()
+        except ConnectionError:
+            _drop_connection(parts.scheme, parts.netloc)
+            if attempt or not reused:
+                raise
+            continue
+        except BaseException:
+            _drop_connection(parts.scheme, parts.netloc)
+            raise
+        break
+    # Redirects are not followed; like any other non-2xx reply they surface
+    # as HTTPError rather than a body that fails to parse later.
+    if not 200 <= resp.status < 300:
+        raise urllib.error.HTTPError(
+            url, resp.status, resp.reason, resp.headers, io.BytesIO(data)
+        )
+    return data
+
+
 def call_openai_chat(
     api_base: str,
     api_key: str,
@@ -210,39 +727,115 @@ def call_openai_chat(
     messages: List[Dict[str, str]],
     temperature: float = 0.2,
 ) -> str:
-    url = api_base.rstrip("/") + "/v1/chat/completions"
-    payload = json.dumps(
+    payload = json_dumps_bytes(
         {
             "model": model,
             "messages": messages,
             "temperature": temperature,
         }
-    ).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=payload,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        },
-        method="POST",
     )
-    with urllib.request.urlopen(req, timeout=60) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
+    raw = openai_request(api_base, api_key, "/v1/chat/completions", payload)
+    data = json_loads(raw)
     return data["choices"][0]["message"]["content"]
 
 
-def generate_synthetic_input(
-    free_text: str,
-    protocol_chunks: List[ProtocolChunk],
+def submit_batch(
+    bodies: List[Dict[str, Any]],
     api_base: str,
     api_key: str,
-    model: str,
-) -> Dict[str, Any]:
+    poll_interval: float = 30,
+) -> List[str]:
+    """Run chat completion bodies through the Batch API, in input order.
+
+    Uploads one JSONL request file, creates a 24h batch job, polls until it
+    finishes and reads the output file back keyed by ``custom_id``.
+    """
+    lines = [
+        json_dumps_bytes(
+            {
+                "custom_id": f"ft-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+        )
+        for i, body in enumerate(bodies)
+    ]
+    boundary = uuid.uuid4().hex
+    upload = b"".join(
+        [
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="purpose"\r\n\r\n'
+            "batch\r\n"
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="batch.jsonl"\r\n'
+            "Content-Type: application/jsonl\r\n\r\n".encode("utf-8"),
+            b"\n".join(lines),
+            f"\r\n--{boundary}--\r\n".encode("utf-8"),
+        ]
+    )
+    uploaded = json_loads(
+        openai_request(
+            api_base,
+            api_key,
+            "/v1/files",
+            upload,
+            content_type=f"multipart/form-data; boundary={boundary}",
+        )
+    )
+    batch = json_loads(
+        openai_request(
+            api_base,
+            api_key,
+            "/v1/batches",
+            json_dumps_bytes(
+                {
+                    "input_file_id": uploaded["id"],
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h",
+                }
+            ),
+        )
+    )
+    while batch["status"] not in BATCH_TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = json_loads(
+            openai_request(api_base, api_key, f"/v1/batches/{batch['id']}")
+        )
+    if batch["status"] != "completed" or not batch.get("output_file_id"):
+        raise RuntimeError(
+            f"Batch {batch['id']} ended with status {batch['status']}."
+        )
+
+    output = openai_request(
+        api_base, api_key, f"/v1/files/{batch['output_file_id']}/content"
+    ).decode("utf-8")
+    contents: Dict[str, str] = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json_loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") == 200:
+            contents[result["custom_id"]] = response["body"]["choices"][0][
+                "message"
+            ]["content"]
+    missing = [f"ft-{i}" for i in range(len(bodies)) if f"ft-{i}" not in contents]
+    if missing:
+        raise RuntimeError(
+            f"Batch {batch['id']} has no successful result for: {', '.join(missing)}"
+        )
+    return [contents[f"ft-{i}"] for i in range(len(bodies))]
+
+
+def build_synthetic_messages(
+    free_text: str,
+    index: ProtocolIndex,
+) -> List[Dict[str, str]]:
     allowed = [
-        {"theme": chunk.title, "protocol_name": chunk.protocol_name}
-        for chunk in protocol_chunks
-        if chunk.protocol_name
+        {"theme": title, "protocol_name": name}
+        for title, name in zip(index.titles, index.names)
+        if name
     ]
     system_prompt = (
         "You generate synthetic member input JSON for Superpower Coach. "
@@ -292,21 +885,31 @@ def generate_synthetic_input(
                 ],
             },
         },
-        indent=2,
-        ensure_ascii=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
     )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def generate_synthetic_input(
+    free_text: str,
+    index: ProtocolIndex,
+    api_base: str,
+    api_key: str,
+    model: str,
+) -> Dict[str, Any]:
     content = call_openai_chat(
         api_base=api_base,
         api_key=api_key,
         model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.3,
+        messages=build_synthetic_messages(free_text, index),
+        temperature=SYNTHETIC_TEMPERATURE,
     )
     json_text = strip_code_fences(content)
-    return json.loads(json_text)
+    return json_loads(json_text)
 
 
 def generate_emails_from_prompt(
@@ -328,6 +931,95 @@ def generate_emails_from_prompt(
     return content
 
 
+class RateLimiter:
+    """Space out call starts so at most ``per_minute`` begin each minute."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def run_concurrently(
+    fn: Callable[[T], R],
+    items: List[T],
+    max_workers: int = 8,
+    limiter: Optional[RateLimiter] = None,
+) -> List[R]:
+    """Apply fn to items on a thread pool, returning results in input order."""
+
+    def call(item: T) -> R:
+        if limiter:
+            limiter.acquire()
+        return fn(item)
+
+    if len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(call, items))
+
+
+def generate_synthetic_inputs(
+    free_texts: List[str],
+    index: ProtocolIndex,
+    api_base: str,
+    api_key: str,
+    model: str,
+    max_workers: int = 8,
+    limiter: Optional[RateLimiter] = None,
+) -> List[Dict[str, Any]]:
+    return run_concurrently(
+        lambda free_text: generate_synthetic_input(
+            free_text=free_text,
+            index=index,
+            api_base=api_base,
+            api_key=api_key,
+            model=model,
+        ),
+        free_texts,
+        max_workers=max_workers,
+        limiter=limiter,
+    )
+
+
+def generate_synthetic_inputs_batch(
+    free_texts: List[str],
+    index: ProtocolIndex,
+    api_base: str,
+    api_key: str,
+    model: str,
+    poll_interval: float = 30,
+) -> List[Dict[str, Any]]:
+    bodies = [
+        {
+            "model": model,
+            "messages": build_synthetic_messages(free_text, index),
+            "temperature": SYNTHETIC_TEMPERATURE,
+        }
+        for free_text in free_texts
+    ]
+    contents = submit_batch(bodies, api_base, api_key, poll_interval=poll_interval)
+    return [json_loads(strip_code_fences(content)) for content in contents]
+
+
+def indexed_path(path: str, i: int, total: int) -> Path:
+    """Suffix path with the 1-based member number when writing several outputs."""
+    p = Path(path)
+    if total == 1:
+        return p
+    return p.with_name(f"{p.stem}_{i + 1}{p.suffix}")
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="RAG workflow for Superpower Coach")
     parser.add_argument(
@@ -336,13 +1028,22 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "--free-text",
-        help="Free text to generate synthetic input JSON with LLM",
+        nargs="+",
+        help=(
+            "Free text to generate synthetic input JSON with LLM; pass several "
+            "to run them concurrently (outputs are suffixed _1, _2, ...)"
+        ),
     )
     parser.add_argument(
         "--protocols",
         default="protocols.txt",
         help="Path to protocols.txt",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Reparse protocols.txt instead of using the .cache/ index pickle",
+    )
     parser.add_argument(
         "--prompt",
         default="prompt.txt",
@@ -387,6 +1088,29 @@ def parse_args() -> argparse.Namespace:
         default=os.getenv("OPENAI_API_KEY", ""),
         help="LLM API key (default from OPENAI_API_KEY)",
     )
+    parser.add_argument(
+        "--llm-max-workers",
+        type=int,
+        default=8,
+        help="Maximum concurrent LLM requests (default 8)",
+    )
+    parser.add_argument(
+        "--llm-rpm",
+        type=float,
+        default=0,
+        help="Maximum LLM requests started per minute (default 0, unlimited)",
+    )
+    parser.add_argument(
+        "--batch-api",
+        action="store_true",
+        help="Generate --free-text inputs through the OpenAI Batch API (slow, cheaper)",
+    )
+    parser.add_argument(
+        "--batch-poll-interval",
+        type=float,
+        default=30,
+        help="Seconds between Batch API status checks (default 30)",
+    )
     return parser.parse_args()
 
 
@@ -396,55 +1120,89 @@ def main() -> None:
     protocols_path = Path(args.protocols)
     prompt_path = Path(args.prompt)
 
-    protocols_text = read_text(protocols_path)
     prompt_text = read_text(prompt_path)
 
-    protocol_chunks = parse_protocol_chunks(protocols_text)
+    if args.no_cache:
+        protocol_chunks = parse_protocol_file(protocols_path)
+        index = build_protocol_index(protocol_chunks)
+    else:
+        index = load_or_parse(protocols_path)
+    limiter = RateLimiter(args.llm_rpm)
     if args.free_text:
         if not args.llm_api_key:
             raise ValueError(
                 "LLM API key missing. Set OPENAI_API_KEY or pass --llm-api-key."
             )
-        input_data = generate_synthetic_input(
-            free_text=args.free_text,
-            protocol_chunks=protocol_chunks,
-            api_base=args.llm_api_base,
-            api_key=args.llm_api_key,
-            model=args.llm_model,
-        )
-        if args.synthetic_output:
-            Path(args.synthetic_output).write_text(
-                json.dumps(input_data, indent=2, ensure_ascii=True),
-                encoding="utf-8",
+        if args.batch_api:
+            input_datas = generate_synthetic_inputs_batch(
+                free_texts=args.free_text,
+                index=index,
+                api_base=args.llm_api_base,
+                api_key=args.llm_api_key,
+                model=args.llm_model,
+                poll_interval=args.batch_poll_interval,
             )
+        else:
+            input_datas = generate_synthetic_inputs(
+                free_texts=args.free_text,
+                index=index,
+                api_base=args.llm_api_base,
+                api_key=args.llm_api_key,
+                model=args.llm_model,
+                max_workers=args.llm_max_workers,
+                limiter=limiter,
+            )
+        if args.synthetic_output:
+            for i, input_data in enumerate(input_datas):
+                _write_json(
+                    indexed_path(args.synthetic_output, i, len(input_datas)),
+                    input_data,
+                )
     else:
         if not args.input:
             raise ValueError("Provide --input or --free-text.")
         input_path = Path(args.input)
-        input_data = json.loads(read_text(input_path))
+        input_datas = [json_loads(read_text(input_path))]
 
-    selected_protocols = input_data.get("PRO") or input_data.get("selected_protocols")
-    if not isinstance(selected_protocols, list):
-        raise ValueError("Input JSON must include PRO or selected_protocols as a list.")
+    total = len(input_datas)
+    combined_prompts: List[str] = []
+    for i, input_data in enumerate(input_datas):
+        selected_protocols = input_data.get("PRO") or input_data.get(
+            "selected_protocols"
+        )
+        if not isinstance(selected_protocols, list):
+            raise ValueError(
+                "Input JSON must include PRO or selected_protocols as a list."
+            )
 
-    rag_protocols = build_rag_protocols(selected_protocols, protocol_chunks)
+        rag_protocols = build_rag_protocols(selected_protocols, index)
 
-    if args.rag_output:
-        Path(args.rag_output).write_text(
-            json.dumps(rag_protocols, indent=2, ensure_ascii=True),
-            encoding="utf-8",
-        )
+        if args.rag_output:
+            _write_json(indexed_path(args.rag_output, i, total), rag_protocols)
 
-    prompt_input = build_prompt_input(input_data, rag_protocols)
-    if args.format == "json":
-        output_text = json.dumps(prompt_input, indent=2, ensure_ascii=True)
-    else:
-        output_text = build_combined_prompt(prompt_text, prompt_input)
+        prompt_input = build_prompt_input(input_data, rag_protocols)
+        # The email step needs the combined prompt as a string anyway; build it
+        # once and reuse it for --output rather than serializing again.
+        combined_prompt: Optional[str] = None
+        if args.generate_emails:
+            combined_prompt = build_combined_prompt(prompt_text, prompt_input)
+            combined_prompts.append(combined_prompt)
 
-    if args.output:
-        Path(args.output).write_text(output_text, encoding="utf-8")
-    else:
-        print(output_text)
+        def emit(f: TextIO) -> None:
+            if args.format == "json":
+                json.dump(prompt_input, f, indent=2, ensure_ascii=True)
+            elif combined_prompt is not None:
+                f.write(combined_prompt)
+            else:
+                write_combined_prompt(f, prompt_text, prompt_input)
+
+        if args.output:
+            output_path = indexed_path(args.output, i, total)
+            with output_path.open("w", encoding="utf-8") as f:
+                emit(f)
+        else:
+            emit(sys.stdout)
+            print()
 
     # Generate emails if requested
     if args.generate_emails:
@@ -458,15 +1216,21 @@ def main() -> None:
             )
 
         print("Generating email series with LLM...")
-        combined_prompt = build_combined_prompt(prompt_text, prompt_input)
-        emails = generate_emails_from_prompt(
-            combined_prompt=combined_prompt,
-            api_base=args.llm_api_base,
-            api_key=args.llm_api_key,
-            model=args.llm_model,
+        all_emails = run_concurrently(
+            lambda combined_prompt: generate_emails_from_prompt(
+                combined_prompt=combined_prompt,
+                api_base=args.llm_api_base,
+                api_key=args.llm_api_key,
+                model=args.llm_model,
+            ),
+            combined_prompts,
+            max_workers=args.llm_max_workers,
+            limiter=limiter,
         )
-        Path(args.emails_output).write_text(emails, encoding="utf-8")
-        print(f"Email series written to {args.emails_output}")
+        for i, emails in enumerate(all_emails):
+            emails_path = indexed_path(args.emails_output, i, total)
+            emails_path.write_text(emails, encoding="utf-8")
+            print(f"Email series written to {emails_path}")
 
 
 if __name__ == "__main__":
@@ -31,9 +31,19 @@ else
     exit 1
 fi
 
-# Test 3: Email generation (optional - requires API key)
+# Test 3: Parser and helper regression checks
+echo "Test 3: Parser and helper regression checks"
+python3 test_rag_workflow.py > /dev/null
+if [ $? -eq 0 ]; then
+    echo "✓ Regression checks passed"
+else
+    echo "✗ Regression checks failed"
+    exit 1
+fi
+
+# Test 4: Email generation (optional - requires API key)
 if [ ! -z "$OPENAI_API_KEY" ]; then
-    echo "Test 3: Email generation with LLM"
+    echo "Test 4: Email generation with LLM"
     python3 rag_workflow.py \
         --input example_input.json \
         --generate-emails \
@@ -46,7 +56,7 @@ if [ ! -z "$OPENAI_API_KEY" ]; then
         exit 1
     fi
 else
-    echo "Test 3: Email generation (skipped - no OPENAI_API_KEY)"
+    echo "Test 4: Email generation (skipped - no OPENAI_API_KEY)"
 fi
 
 echo
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""Regression checks for rag_workflow helpers (run directly or via pytest)."""
+
+import email.parser
+import email.policy
+import http.server
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+import rag_workflow as rw
+
+FUZZ_LINES = [
+    "## Vitamin D Protocol",
+    "## ",
+    "##",
+    "  ##   ",
+    " ## Omega 3",
+    "### Primary Recommendation",
+    "### Secondary Recommendations",
+    "### Safety Considerations",
+    "###  Evidence Sources  ",
+    "### Other",
+    "###",
+    "### ",
+    "#### Note",
+    "Primary Recommendation",
+    "Evidence Sources",
+    "**Protocol:** Daily supplement",
+    "  **Protocol:**",
+    "Take 2000 IU daily.",
+    "- with food",
+    "",
+    "   ",
+]
+
+
+# Mostly "\n", but every other boundary str.splitlines() recognises too.
+FUZZ_SEPARATORS = ["\n"] * 10 + list("\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029") + ["\r\n"]
+
+
+def fuzz_blocks(seed: int, count: int) -> List[str]:
+    rng = random.Random(seed)
+    blocks = []
+    for _ in range(count):
+        lines = [rng.choice(FUZZ_LINES) for _ in range(rng.randint(0, 12))]
+        block = "".join(line + rng.choice(FUZZ_SEPARATORS) for line in lines)
+        blocks.append(block.rstrip("\n") + rng.choice(["", "\n", "\n\n"]))
+    return blocks
+
+
+def reference_split_protocol_blocks(block: str) -> List[str]:
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    for line in block.splitlines():
+        if line.strip().startswith("## "):
+            if current:
+                chunks.append(current)
+            current = [line]
+        elif current:
+            current.append(line)
+    if current:
+        chunks.append(current)
+    return ["\n".join(c).strip() for c in chunks]
+
+
+def test_split_protocol_blocks_matches_line_scan():
+    for block in fuzz_blocks(7, 3000):
+        expected = reference_split_protocol_blocks(block)
+        assert rw.split_protocol_blocks(block) == expected, repr(block)
+
+
+def test_split_protocol_blocks_uses_splitlines_boundaries():
+    assert rw.split_protocol_blocks("intro\x0c## A\nbody") == ["## A\nbody"]
+    assert rw.split_protocol_blocks("## A\u2028## B") == ["## A", "## B"]
+
+
+def test_bare_h2_line_does_not_start_a_chunk():
+    block = "## A\nbody\n## \nmore\n##\n"
+    assert rw.split_protocol_blocks(block) == ["## A\nbody\n## \nmore\n##"]
+
+
+def test_crlf_protocol_file_parses_like_the_original():
+    protocols = Path(__file__).with_name("protocols.txt")
+    expected = rw.parse_protocol_chunks(rw.read_text(protocols))
+    with tempfile.TemporaryDirectory() as tmp:
+        for newline in (b"\r\n", b"\r"):
+            copy = Path(tmp, "protocols.txt")
+            copy.write_bytes(protocols.read_bytes().replace(b"\n", newline))
+            assert rw.parse_protocol_file(copy) == expected
+            index = rw.load_or_parse(copy, Path(tmp, "cache"))
+            assert index.titles == [c.title for c in expected]
+        unicode_info = Path(tmp, "unicode.txt")
+        unicode_info.write_text("```é\n## A\n**Protocol:** x\n```\n", encoding="utf-8")
+        assert [c.title for c in rw.parse_protocol_file(unicode_info)] == ["A"]
+
+
+def test_protocol_cache_is_best_effort():
+    protocols = Path(__file__).with_name("protocols.txt")
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = rw.load_or_parse(protocols, Path(tmp, "fresh"))
+        not_a_dir = Path(tmp, "cache")
+        not_a_dir.write_text("")
+        assert rw.load_or_parse(protocols, not_a_dir).titles == expected.titles
+        stale = Path(tmp, "stale")
+        stale.mkdir()
+        # A pickle naming a module that no longer exists.
+        stale.joinpath("protocols.pkl").write_bytes(b"cno_such_module\nIndex\n.")
+        assert rw.load_or_parse(protocols, stale).titles == expected.titles
+
+
+SECTIONS = {
+    "primary_recommendation": "Primary Recommendation",
+    "secondary_recommendations": "Secondary Recommendations",
+    "safety_considerations": "Safety Considerations",
+    "evidence_sources": "Evidence Sources",
+}
+
+
+def reference_extract_section(text: str, heading: str) -> str:
+    match = re.search(rf"^###\s+{re.escape(heading)}\s*$", text, flags=re.M)
+    if not match:
+        return ""
+    start = match.end()
+    next_heading = re.search(r"^###\s+.+\s*$", text[start:], flags=re.M)
+    end = start + next_heading.start() if next_heading else len(text)
+    return text[start:end].strip()
+
+
+def reference_parse_protocol_block(block: str) -> List[dict]:
+    chunks = []
+    for chunk_text in reference_split_protocol_blocks(block):
+        lines = chunk_text.splitlines()
+        protocol_name = ""
+        for line in lines:
+            if line.strip().startswith("**Protocol:**"):
+                protocol_name = line.replace("**Protocol:**", "").strip()
+                break
+        chunk = {
+            "title": lines[0].strip().replace("##", "", 1).strip(),
+            "protocol_name": protocol_name,
+            "body": chunk_text,
+        }
+        for field, heading in SECTIONS.items():
+            chunk[field] = reference_extract_section(chunk_text, heading)
+        chunks.append(chunk)
+    return chunks
+
+
+def test_parse_protocol_block_matches_original_parser():
+    fields = ["title", "protocol_name", "body", *SECTIONS]
+    for block in fuzz_blocks(22, 3000):
+        got = [
+            {field: getattr(chunk, field) for field in fields}
+            for chunk in rw.parse_protocol_block(block)
+        ]
+        assert got == reference_parse_protocol_block(block), repr(block)
+
+
+def test_bare_h3_line_ends_a_section():
+    block = "## A\n### Primary Recommendation\nTake it.\n###\nnot primary\n"
+    (chunk,) = rw.parse_protocol_block(block)
+    assert chunk.primary_recommendation == "Take it."
+
+
+def tiny_index() -> "rw.ProtocolIndex":
+    return rw.build_protocol_index(
+        rw.parse_protocol_block(
+            "## Iron Support Plan\n**Protocol:** Ferritin Builder\n"
+            "## Blood Health\n**Protocol:** Iron Support\n"
+        )
+    )
+
+
+def test_exact_protocol_name_beats_the_jaccard_best():
+    index = tiny_index()
+    # By Jaccard "Plan Iron Support" is closest to chunk 0's title...
+    assert rw.best_match_protocol("Plan IRON SUPPORT", index) == 0
+    # ...but chunk 1's protocol name matches exactly, ignoring case.
+    assert rw.match_protocol("Plan", "IRON SUPPORT", index) == 1
+    # A case-insensitive exact title wins the same way.
+    assert rw.best_match_protocol("Blood Health Iron Support Plan", index) == 0
+    assert rw.match_protocol("blood HEALTH", "Iron Support Plan", index) == 1
+    assert rw.match_protocol("Iron Plan", "", index) == 0
+
+
+def run_cli(*args: str) -> subprocess.CompletedProcess:
+    script = Path(__file__).with_name("rag_workflow.py")
+    return subprocess.run(
+        [sys.executable, str(script), *args],
+        cwd=script.parent,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_input_json_is_parsed_like_json_loads():
+    input_text = Path(__file__).with_name("example_input.json").read_text()
+    with tempfile.TemporaryDirectory() as tmp:
+        nan_input = Path(tmp, "nan.json")
+        nan_input.write_text(input_text.replace('"B": {', '"B": {"score": NaN, ', 1))
+        result = run_cli("--input", str(nan_input), "--format", "json")
+        assert result.returncode == 0, result.stderr
+        assert '"score": NaN' in result.stdout
+        bom_input = Path(tmp, "bom.json")
+        bom_input.write_text("\ufeff" + input_text, encoding="utf-8")
+        result = run_cli("--input", str(bom_input), "--format", "json")
+        assert result.returncode != 0
+        assert "BOM" in result.stderr, result.stderr
+    assert rw.json_loads(b"[18446744073709551616, NaN]")[0] == 2**64
+
+
+def test_prompt_input_builder_matches_build_prompt_input():
+    samples = [
+        {"B": {"x": 1}, "P": None, "preference_analysis": {"y": 2}, "PRO": []},
+        {"biomarker_analysis": 1, "C": "", "patient_context": "", "PRO": [1]},
+        {},
+    ]
+    for sample in samples:
+        build = rw.make_prompt_input_builder(sample)
+        assert build(sample, ["pd"]) == rw.build_prompt_input(sample, ["pd"])
+
+
+class _EchoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.endswith("/slow"):
+            time.sleep(0.5)
+        body = " ".join(
+            [self.path, self.headers.get("Proxy-Authorization", "-")]
+        ).encode("utf-8")
+        self.send_response(302 if self.path.endswith("/moved") else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass  # the client timed out and hung up
+
+    def log_message(self, *args):
+        pass
+
+
+class _BatchHandler(http.server.BaseHTTPRequestHandler):
+    """A fake /v1/files + /v1/batches flow; results come back reversed."""
+
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, body):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        state = self.server.state
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                + raw
+            )
+            parts = {
+                part.get_param("name", header="content-disposition"): part
+                for part in message.iter_parts()
+            }
+            assert parts["purpose"].get_content().strip() == "batch"
+            state["requests"] = [
+                json.loads(line)
+                for line in parts["file"].get_payload(decode=True).splitlines()
+            ]
+            return self.reply({"id": "file-in"})
+        assert self.path == "/v1/batches"
+        assert json.loads(raw)["input_file_id"] == "file-in"
+        return self.reply({"id": "batch-1", "status": "validating"})
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == "/v1/batches/batch-1":
+            state["polls"] += 1
+            done = state["polls"] >= 2
+            return self.reply(
+                {
+                    "id": "batch-1",
+                    "status": "completed" if done else "in_progress",
+                    "output_file_id": "file-out" if done else None,
+                }
+            )
+        assert self.path == "/v1/files/file-out/content"
+        lines = []
+        for request in reversed(state["requests"]):
+            content = request["body"]["messages"][-1]["content"]
+            status = 500 if content == state.get("fail") else 200
+            body = {"choices": [{"message": {"content": f"re: {content}"}}]}
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": status, "body": body},
+                    }
+                )
+            )
+        return self.reply("\n".join(lines).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def echo_server(handler: type = _EchoHandler, **state) -> Iterator[str]:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.state = dict(state, polls=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_timed_out_request_does_not_poison_the_connection():
+    with echo_server() as base:
+        assert rw.openai_request(base, "k", "/fast") == b"/fast -"
+        try:
+            rw.openai_request(base, "k", "/slow", timeout=0.1)
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected a timeout")
+        assert rw.openai_request(base, "k", "/fast") == b"/fast -"
+
+
+def test_non_2xx_response_raises():
+    with echo_server() as base:
+        try:
+            rw.openai_request(base, "k", "/moved")
+        except urllib.error.HTTPError as exc:
+            assert exc.code == 302
+        else:
+            raise AssertionError("expected HTTPError")
+
+
+def batch_bodies(*texts: str) -> List[dict]:
+    return [{"messages": [{"role": "user", "content": text}]} for text in texts]
+
+
+def test_submit_batch_returns_results_in_input_order():
+    with echo_server(_BatchHandler) as base:
+        results = rw.submit_batch(batch_bodies("a", "b", "c"), base, "k", 0)
+    assert results == ["re: a", "re: b", "re: c"]
+
+
+def test_submit_batch_reports_missing_results():
+    with echo_server(_BatchHandler, fail="b") as base:
+        try:
+            rw.submit_batch(batch_bodies("a", "b"), base, "k", 0)
+        except RuntimeError as exc:
+            assert "ft-1" in str(exc) and "ft-0" not in str(exc), exc
+        else:
+            raise AssertionError("expected RuntimeError")
+
+
+def test_http_proxy_from_environment_is_used():
+    saved = {k: os.environ.pop(k, None) for k in ("http_proxy", "no_proxy")}
+    with echo_server() as proxy:
+        os.environ["http_proxy"] = proxy.replace("//", "//user:p%40ss@")
+        try:
+            data = rw.openai_request("http://api.example.invalid/v1", "k", "/x")
+        finally:
+            os.environ.pop("http_proxy")
+            os.environ.update({k: v for k, v in saved.items() if v is not None})
+    assert data == b"http://api.example.invalid/v1/x Basic dXNlcjpwQHNz", data
+
+
+if __name__ == "__main__":
+    tests = [v for k, v in sorted(globals().items()) if k.startswith("test_")]
+    for test in tests:
+        test()
+    print(f"{len(tests)} checks passed")